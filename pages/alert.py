@@ -2,6 +2,7 @@ import streamlit as st
 import pandas as pd
 import os
 import json
+import openpyxl
 
 SAVE_DIR = "uploaded_files"
 STATE_FILE = os.path.join(SAVE_DIR, "state.json")
@@ -17,72 +18,103 @@ def load_state():
     return {"week1": None, "week2": None, "week3": None, "helper": None}
 
 def save_state(state):
+    # 前回保存した内容から変更がなければ書き込まない
+    serialized = json.dumps(state, ensure_ascii=False, indent=2)
+    persisted = st.session_state.setdefault("_persisted_state", {})
+    if persisted.get(STATE_FILE) == serialized:
+        return
     with open(STATE_FILE, "w", encoding="utf-8") as f:
-        json.dump(state, f, ensure_ascii=False, indent=2)
+        f.write(serialized)
+    persisted[STATE_FILE] = serialized
 
 # ------------------------
 # データ読込関数
 # ------------------------
-def load_weekly_file(filepath):
-    df = pd.read_excel(filepath, header=5)
+def normalize_codes(codes):
+    # 数値のセルは整数経由で文字列化（正規表現で".0"を削らない）
+    # 文字列のセル（"00123"など）は数値に変換せず、従来どおり末尾の".0"だけを削る
+    is_text = pd.Series(False, index=codes.index) if pd.api.types.is_numeric_dtype(codes) else codes.map(lambda v: isinstance(v, str))
+    num = pd.to_numeric(codes.mask(is_text), errors='coerce')
+    num = num.where(num % 1 == 0)
+    as_str = num.astype('Int64').astype('string[pyarrow]')
+    text = codes.astype(str).str.replace(r'\.0$', '', regex=True).astype('string[pyarrow]')
+    return as_str.fillna(text).str.zfill(4)
+
+@st.cache_data(show_spinner=False)
+def load_weekly_file(filepath, mtime):
+    df = pd.read_excel(filepath, header=5, engine="calamine")
     df = df[['得意先コード', '得意先名']].dropna()
     df = df.rename(columns={'得意先コード': '取引先コード', '得意先名': '取引先名'})
-    df['取引先コード'] = df['取引先コード'].astype(str).str.replace(r'\.0$', '', regex=True).str.zfill(4)
+    df['取引先コード'] = normalize_codes(df['取引先コード'])
     return df.drop_duplicates(subset=['取引先コード'])
 
-def load_helper_file(filepath):
-    xls = pd.ExcelFile(filepath)
-    delete_list = pd.read_excel(xls, sheet_name="削除依頼", header=None)[0].astype(str).str.replace(r'\.0$', '', regex=True).str.zfill(4).tolist()
-    
-    # 取引先リストシートを読み込み、ヘッダーを設定
-    base_list = pd.read_excel(xls, sheet_name="取引先リスト", header=None, names=["取引先コード","取引先名", "大分類"])
-    base_list['取引先コード'] = base_list['取引先コード'].astype(str).str.replace(r'\.0$', '', regex=True).str.zfill(4)
-
-    # 離脱リスト：A列=コード, B列=備考
-    leave_df = pd.read_excel(xls, sheet_name="離脱リスト", header=None)
-    leave_df[0] = leave_df[0].astype(str).str.replace(r'\.0$', '', regex=True).str.zfill(4)
-    leave_map = dict(zip(leave_df[0], leave_df[1].fillna("")))
-
-    # 大分類の辞書を作成
-    category_map = dict(zip(base_list['取引先コード'], base_list['大分類'].fillna("")))
-
-    return delete_list, base_list, leave_map, category_map
+@st.cache_data(show_spinner=False)
+def load_helper_file(filepath, mtime):
+    # 1回だけ開いて3シートを読み込む（read_onlyで全セルを展開しない）
+    wb = openpyxl.load_workbook(filepath, read_only=True, data_only=True)
+    try:
+        delete_codes = pd.Series([r[0] for r in wb["削除依頼"].iter_rows(max_col=1, values_only=True) if r[0] is not None], dtype=object)
+
+        # 取引先リスト：A列=コード, B列=取引先名, C列=大分類
+        base_list = pd.DataFrame(
+            [r for r in wb["取引先リスト"].iter_rows(max_col=3, values_only=True) if r[0] is not None],
+            columns=["取引先コード", "取引先名", "大分類"]
+        )
+
+        # 離脱リスト：A列=コード, B列=備考
+        leave_df = pd.DataFrame(
+            [r for r in wb["離脱リスト"].iter_rows(max_col=2, values_only=True) if r[0] is not None],
+            columns=["取引先コード", "備考"]
+        )
+    finally:
+        wb.close()
+
+    delete_list = normalize_codes(delete_codes).tolist()
+    base_list['取引先コード'] = normalize_codes(base_list['取引先コード'])
+    leave_df['取引先コード'] = normalize_codes(leave_df['取引先コード'])
+    leave_df['備考'] = leave_df['備考'].fillna("")
+    leave_df = leave_df.drop_duplicates('取引先コード', keep='last')
+
+    return delete_list, base_list, leave_df
 
 # ------------------------
 # 分析関数
 # ------------------------
 def analyze(week1, week2, week3, helper):
-    delete_list, base_list, leave_map, category_map = helper
+    delete_list, base_list, leave_df = helper
 
-    set1 = set(week1['取引先コード']) - set(delete_list)
-    set2 = set(week2['取引先コード']) - set(delete_list)
-    set3 = set(week3['取引先コード']) - set(delete_list)
+    delete_idx = pd.Index(delete_list)
+    idx1 = pd.Index(week1['取引先コード'].unique()).difference(delete_idx)
+    idx2 = pd.Index(week2['取引先コード'].unique()).difference(delete_idx)
+    idx3 = pd.Index(week3['取引先コード'].unique()).difference(delete_idx)
 
-    name_map = {}
-    for df in [week1, week2, week3, base_list]:
-        for _, row in df.iterrows():
-            name_map[row['取引先コード']] = row['取引先名']
+    # 取引先名の参照表（後に出てくるデータを優先）
+    name_df = pd.concat([week1, week2, week3, base_list])[['取引先コード', '取引先名']].drop_duplicates('取引先コード', keep='last')
+    category_df = base_list[['取引先コード', '大分類']].drop_duplicates('取引先コード', keep='last').fillna({'大分類': ""})
 
     # 2週間未取引
-    two_weeks_none = [c for c in set1 if c not in set2 and c not in set3]
-    df_two = pd.DataFrame([(c, name_map.get(c, ""), category_map.get(c, "")) for c in two_weeks_none], columns=["取引先コード", "取引先名", "大分類"])
+    two_weeks_none = idx1.difference(idx2).difference(idx3)
+    df_two = (
+        pd.DataFrame({'取引先コード': two_weeks_none})
+        .merge(name_df, how='left', on='取引先コード')
+        .merge(category_df, how='left', on='取引先コード')
+        .fillna({'取引先名': "", '大分類': ""})
+    )
 
     # 3週間未取引
-    all_weeks = set1 | set2 | set3
-    three_weeks_none = [c for c in base_list['取引先コード'] if c not in all_weeks]
-
-    rows_normal = []
-    rows_leave = []
-    for c in three_weeks_none:
-        name = name_map.get(c, "")
-        category = category_map.get(c, "")
-        if c in leave_map:
-            rows_leave.append((c, name, category, leave_map[c]))
-        else:
-            rows_normal.append((c, name, category, ""))
+    all_weeks = idx1.union(idx2).union(idx3)
+    three_weeks_none = pd.Index(base_list['取引先コード']).difference(all_weeks, sort=False)
+
+    df_three = (
+        pd.DataFrame({'取引先コード': three_weeks_none})
+        .merge(name_df, how='left', on='取引先コード')
+        .merge(category_df, how='left', on='取引先コード')
+        .merge(leave_df, how='left', on='取引先コード')
+    )
+    is_leave = df_three['備考'].notna()
 
     # 通常 → 離脱の順に結合
-    df_three = pd.DataFrame(rows_normal + rows_leave, columns=["取引先コード", "取引先名", "大分類", "備考"])
+    df_three = pd.concat([df_three[~is_leave], df_three[is_leave]], ignore_index=True).fillna({'取引先名': "", '大分類': "", '備考': ""})
     return df_two, df_three
 
 # ------------------------
@@ -100,14 +132,12 @@ left, right = st.columns([1, 2])
 with left:
     st.subheader("📂 現在のファイル状況")
     file_status_html = "<div style='background-color:#f9f5e9; padding:15px; border-radius:8px; border:1px solid #ddd;'>"
+    status_parts = []
     for label in ["week1", "week2", "week3", "helper"]:
         info = st.session_state.state.get(label)
-        if info and "name" in info:
-            file_status_html += f"<p><strong>{label}</strong>: ✅ {info['name']}</p>"
-        else:
-            file_status_html += f"<p><strong>{label}</strong>: ❌ 未設定</p>"
-    file_status_html += "</div>"
-    st.markdown(file_status_html, unsafe_allow_html=True)
+        status = f"✅ {info['name']}" if info and "name" in info else "❌ 未設定"
+        status_parts.append(f"<p><strong>{label}</strong>: {status}</p>")
+    st.markdown(f"{file_status_html}{''.join(status_parts)}</div>", unsafe_allow_html=True)
 
 # 右側：ファイルアップロード
 with right:
@@ -121,10 +151,13 @@ with right:
 def save_file(uploaded_file, label):
     if uploaded_file:
         filepath = os.path.join(SAVE_DIR, f"{label}.xlsx")
-        with open(filepath, "wb") as f:
-            f.write(uploaded_file.read())
-        st.session_state.state[label] = {"path": filepath, "name": uploaded_file.name}
-        save_state(st.session_state.state)
+        info = {"path": filepath, "name": uploaded_file.name, "file_id": uploaded_file.file_id}
+        # 同じアップロードは再実行のたびに書き直さない（mtimeが変わり読込キャッシュが無効になるため）
+        if st.session_state.state.get(label) != info:
+            with open(filepath, "wb") as f:
+                f.write(uploaded_file.getbuffer())
+            st.session_state.state[label] = info
+            save_state(st.session_state.state)
         return filepath
     info = st.session_state.state.get(label)
     return info["path"] if info else None
@@ -146,10 +179,12 @@ if st.button("🔁 繰り上げ処理"):
 # 分析実行
 if st.button("🚀 分析実行"):
     try:
-        w1 = load_weekly_file(st.session_state.state["week1"]["path"])
-        w2 = load_weekly_file(st.session_state.state["week2"]["path"])
-        w3 = load_weekly_file(st.session_state.state["week3"]["path"])
-        helper = load_helper_file(st.session_state.state["helper"]["path"])
+        # mtimeをキャッシュキーに含め、再アップロード時は読み直す
+        paths = {label: st.session_state.state[label]["path"] for label in ["week1", "week2", "week3", "helper"]}
+        w1 = load_weekly_file(paths["week1"], os.path.getmtime(paths["week1"]))
+        w2 = load_weekly_file(paths["week2"], os.path.getmtime(paths["week2"]))
+        w3 = load_weekly_file(paths["week3"], os.path.getmtime(paths["week3"]))
+        helper = load_helper_file(paths["helper"], os.path.getmtime(paths["helper"]))
 
         df_two, df_three = analyze(w1, w2, w3, helper)
 
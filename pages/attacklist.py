@@ -1,9 +1,12 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import re
 from collections import Counter
+from itertools import chain
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-import openpyxl
+from python_calamine import SheetVisibleEnum
 import os
 import json
 
@@ -21,9 +24,14 @@ def load_state():
     return {"uploaded_file": None}
 
 def save_state(state):
-    """状態ファイルを保存します。"""
+    """状態ファイルを保存します。前回保存した内容から変更がなければ書き込みません。"""
+    serialized = json.dumps(state, ensure_ascii=False, indent=2)
+    persisted = st.session_state.setdefault("_persisted_state", {})
+    if persisted.get(STATE_FILE) == serialized:
+        return
     with open(STATE_FILE, "w", encoding="utf-8") as f:
-        json.dump(state, f, ensure_ascii=False, indent=2)
+        f.write(serialized)
+    persisted[STATE_FILE] = serialized
 
 # ---------------------------- ヘルパー関数 ----------------------------
 def save_file_and_update_state(uploaded_file, file_key):
@@ -39,9 +47,79 @@ def save_file_and_update_state(uploaded_file, file_key):
         return True
     return False
 
+def read_attack_sheet(file_path, sheet):
+    """
+    1シートを読み込み、シート名から担当者・種別を付与します。
+    """
+    df_tmp = pd.read_excel(file_path, sheet_name=sheet, engine="calamine")
+    df_tmp["シート名"] = sheet
+    if "_" in sheet:
+        df_tmp["担当者"], df_tmp["種別"] = sheet.split("_")
+    else:
+        df_tmp["担当者"] = "不明"
+        df_tmp["種別"] = "不明"
+    return df_tmp
+
+def load_attack_workbook(file_path):
+    """
+    表示されている各シートを並列に読み込み、1つのDataFrameに結合します。
+    """
+    with pd.ExcelFile(file_path, engine="calamine") as xls:
+        # ワークブックのメタデータから非表示シートを除外し、表示されているシート名のみを対象とする
+        sheet_names = [m.name for m in xls.book.sheets_metadata if m.visible == SheetVisibleEnum.Visible]
+
+    # シートの分離
+    log_sheet = "操作履歴"
+    main_sheets = [s for s in sheet_names if s != log_sheet]
+
+    # ワークブックのハンドルはスレッド間で共有できないため、各スレッドでシートごとに開く
+    with ThreadPoolExecutor(max_workers=max(1, min(8, len(main_sheets)))) as executor:
+        df_list = list(executor.map(lambda sheet: read_attack_sheet(file_path, sheet), main_sheets))
+
+    return pd.concat(df_list, ignore_index=True)
+
 # 定数
 KINIKI_AREAS = ["大阪", "奈良", "京都", "滋賀", "兵庫", "三重", "和歌山"]
 VALID_CATEGORIES = ["駅", "高速", "空港", "一般店", "量販店", "商社"]
+CATEGORY_PATTERN = re.compile(r"【(.*?)】")
+
+@st.cache_data(show_spinner=False)
+def prepare_attacklist(file_path, mtime):
+    """
+    アタックリストを読み込んで整形し、フィルターフォームの選択肢と合わせて返します。
+    mtimeはキャッシュキーとしてのみ使用し、ファイルが更新されるまで再計算しません。
+    """
+    df = load_attack_workbook(file_path)
+    df["記入日"] = pd.to_datetime(df["記入日"], errors="coerce")
+
+    # 地域データの正規化
+    area = df["地域"]
+    area_str = area.astype(str)
+    unclassified = area.isna() | (area_str.str.strip() == "") | area_str.str.startswith("その他：")
+    area = area.mask(unclassified, "未分類")
+    df["地域"] = area.where(area.isin(KINIKI_AREAS + ["未分類"]), "その他")
+
+    # カテゴリの抽出 (採用・不採用理由から)
+    categories = df["採用・不採用理由"].astype(str).str.extract(CATEGORY_PATTERN, expand=False).str.split("・")
+    df["カテゴリ"] = [c if isinstance(c, list) else [] for c in categories]
+
+    # フィルターの選択肢
+    persons = [p for p in sorted(df["担当者"].dropna().unique()) if p != "不明"]
+    types = [t for t in sorted(df["種別"].dropna().unique()) if t != "不明"]
+    areas = sorted(set(df["地域"].dropna().unique().tolist() + ["未分類"]))
+    cats = sorted([c for c in df["大分類"].dropna().unique() if c in VALID_CATEGORIES])
+
+    # 絞り込みに使う列はカテゴリ型にし、isinをコード比較で済ませる
+    for col in ["担当者", "種別", "地域", "大分類"]:
+        df[col] = df[col].astype("category")
+
+    # シートごとの行範囲（担当者, 種別, 開始行, 終了行）。シートは連続した行として結合されている
+    sheet_col = df["シート名"].to_numpy()
+    starts = np.flatnonzero(np.r_[True, sheet_col[1:] != sheet_col[:-1]]) if len(df) else np.array([], dtype=int)
+    stops = np.r_[starts[1:], len(df)]
+    sheet_ranges = [(df["担当者"].iat[start], df["種別"].iat[start], start, stop) for start, stop in zip(starts, stops)]
+
+    return df, sheet_ranges, persons, types, areas, cats, df["記入日"].min(), df["記入日"].max()
 
 # ページ設定
 st.set_page_config(layout="wide")
@@ -63,12 +141,8 @@ with left_col:
     file_status_html = "<div style='background-color:#f9f5e9; padding:15px; border-radius:8px; border:1px solid #ddd;'>"
     
     info = st.session_state.state.get("uploaded_file")
-    if info and "name" in info:
-        file_status_html += f"<p><strong>アタックリストファイル</strong>: ✅ {info['name']}</p>"
-    else:
-        file_status_html += f"<p><strong>アタックリストファイル</strong>: ❌ 未設定</p>"
-    file_status_html += "</div>"
-    st.markdown(file_status_html, unsafe_allow_html=True)
+    status = f"✅ {info['name']}" if info and "name" in info else "❌ 未設定"
+    st.markdown(f"{file_status_html}<p><strong>アタックリストファイル</strong>: {status}</p></div>", unsafe_allow_html=True)
 
 with right_col:
     # 段階的なUIの導入
@@ -95,61 +169,16 @@ with right_col:
                 st.markdown("---")
                 st.subheader("2️⃣ 訪問データの絞り込みと分析実行")
 
-                # openpyxlでワークブックを読み込み、非表示シートを特定
-                workbook = openpyxl.load_workbook(file_path, read_only=True)
-                visible_sheet_names = [sheet_name for sheet_name in workbook.sheetnames if workbook[sheet_name].sheet_state == 'visible']
-                
-                # pandas.ExcelFileオブジェクトを作成
-                xls = pd.ExcelFile(file_path)
-                
-                # 表示されているシート名のみを対象とする
-                sheet_names = [s for s in xls.sheet_names if s in visible_sheet_names]
-                
-                # シートの分離
-                log_sheet = "操作履歴"
-                main_sheets = [s for s in sheet_names if s != log_sheet]
-                
-                # 主要データの読み込みと結合
-                df_list = []
-                for sheet in main_sheets:
-                    df_tmp = pd.read_excel(xls, sheet_name=sheet)
-                    df_tmp["シート名"] = sheet
-                    if "_" in sheet:
-                        df_tmp["担当者"], df_tmp["種別"] = sheet.split("_")
-                    else:
-                        df_tmp["担当者"] = "不明"
-                        df_tmp["種別"] = "不明"
-                    df_list.append(df_tmp)
-                
-                df = pd.concat(df_list, ignore_index=True)
-                df["記入日"] = pd.to_datetime(df["記入日"], errors="coerce")
-                
-                # 地域データの正規化
-                df["地域"] = df["地域"].apply(lambda x: "未分類" if pd.isna(x) or str(x).strip() == "" or str(x).startswith("その他：") else x)
-                df["地域"] = df["地域"].apply(lambda x: "その他" if x not in KINIKI_AREAS and x != "未分類" else x)
-                
-                # カテゴリの抽出 (採用・不採用理由から)
-                df["カテゴリ"] = df["採用・不採用理由"].apply(
-                    lambda x: re.findall(r"【(.*?)】", str(x))[0].split("・") if re.findall(r"【(.*?)】", str(x)) else [])
-                
+                # データ読み込みと絞り込み候補の作成（ファイル更新時のみ再計算）
+                df, sheet_ranges, persons, types, areas, cats, min_date, max_date = prepare_attacklist(file_path, os.path.getmtime(file_path))
+
                 # 訪問データフィルターフォーム
                 with st.form("main_filter_form"):
-                    persons_all = sorted(df["担当者"].dropna().unique())
-                    persons = [p for p in persons_all if p != "不明"]
-                    types_all = sorted(df["種別"].dropna().unique())
-                    types = [t for t in types_all if t != "不明"]
-                    areas_raw = df["地域"].dropna().unique().tolist()
-                    areas = sorted(list(set(areas_raw + ["未分類"])))
-                    cats = sorted([c for c in df["大分類"].dropna().unique() if c in VALID_CATEGORIES])
-                    
                     selected_persons = st.multiselect("担当者", persons, default=persons)
                     selected_types = st.multiselect("種別", types, default=types)
                     selected_areas = st.multiselect("地域", areas, default=areas)
                     selected_categories = st.multiselect("大分類", cats, default=cats)
                     
-                    min_date = df["記入日"].min()
-                    max_date = df["記入日"].max()
-                    
                     if pd.isna(min_date) or pd.isna(max_date):
                         st.warning("「記入日」データに有効な日付が見つかりませんでした。日付フィルターは利用できません。")
                         start_date = None
@@ -160,21 +189,19 @@ with right_col:
                     submitted = st.form_submit_button("🚀 分析実行")
                 
                 if submitted:
-                    if start_date and end_date:
-                        df_filtered_calc = df[
-                            df["担当者"].isin(selected_persons) &
-                            df["種別"].isin(selected_types) &
-                            df["地域"].isin(selected_areas) &
-                            df["大分類"].isin(selected_categories) &
-                            df["記入日"].between(pd.to_datetime(start_date), pd.to_datetime(end_date), inclusive="both")
-                        ]
-                    else:
-                        df_filtered_calc = df[
-                            df["担当者"].isin(selected_persons) &
-                            df["種別"].isin(selected_types) &
-                            df["地域"].isin(selected_areas) &
-                            df["大分類"].isin(selected_categories)
-                        ]
+                    # 担当者・種別はシート単位で決まるため、対象外のシートは行を見ずに除外し、
+                    # 残ったシート内で地域・大分類・記入日のマスクをかけてから結合する
+                    survivors = []
+                    for person, kind, start, stop in sheet_ranges:
+                        if person not in selected_persons or kind not in selected_types:
+                            continue
+                        part = df.iloc[start:stop]
+                        mask = part["地域"].isin(selected_areas).to_numpy() & part["大分類"].isin(selected_categories).to_numpy()
+                        if start_date and end_date:
+                            dates = part["記入日"].to_numpy()
+                            mask &= (dates >= pd.Timestamp(start_date).to_datetime64()) & (dates <= pd.Timestamp(end_date).to_datetime64())
+                        survivors.append(part[mask])
+                    df_filtered_calc = pd.concat(survivors) if survivors else df.iloc[:0]
                     st.session_state.df_filtered_display = df_filtered_calc
                     st.success("分析が完了しました。")
             except Exception as e:
@@ -206,8 +233,8 @@ if st.session_state.df_filtered_display is not None:
 
         df_saiyo = df_filtered_to_display[df_filtered_to_display["結果"] == "採用"]
         df_fusaiyo = df_filtered_to_display[df_filtered_to_display["結果"] == "不採用"]
-        cat_saiyo = Counter(sum(df_saiyo["カテゴリ"], []))
-        cat_fusaiyo = Counter(sum(df_fusaiyo["カテゴリ"], []))
+        cat_saiyo = Counter(chain.from_iterable(df_saiyo["カテゴリ"]))
+        cat_fusaiyo = Counter(chain.from_iterable(df_fusaiyo["カテゴリ"]))
 
         df_saiyo_cat = pd.DataFrame(cat_saiyo.items(), columns=["カテゴリ", "件数"])
         df_fusaiyo_cat = pd.DataFrame(cat_fusaiyo.items(), columns=["カテゴリ", "件数"])
@@ -1,5 +1,6 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import re
 import os
 import json
@@ -18,20 +19,39 @@ def load_state():
     return {"class_file": None, "data_file": None}
 
 def save_state(state):
-    """状態ファイルを保存します。"""
+    """状態ファイルを保存します。前回保存した内容から変更がなければ書き込みません。"""
+    serialized = json.dumps(state, ensure_ascii=False, indent=2)
+    persisted = st.session_state.setdefault("_persisted_state", {})
+    if persisted.get(STATE_FILE) == serialized:
+        return
     with open(STATE_FILE, "w", encoding="utf-8") as f:
-        json.dump(state, f, ensure_ascii=False, indent=2)
+        f.write(serialized)
+    persisted[STATE_FILE] = serialized
 
 # ---------------------------- ヘルパー関数 ----------------------------
 
+@st.cache_data(show_spinner=False)
+def load_xlsx(filepath, mtime, **read_kwargs):
+    """
+    保存されたExcelファイルを読み込みます。
+    mtimeはキャッシュキーとしてのみ使用し、ファイルが更新されるまで再読込しません。
+    """
+    return pd.read_excel(filepath, engine="calamine", **read_kwargs)
+
 def read_uploaded_file(filepath):
     """
-    保存されたExcelファイルを読み込み、シート名をキー、DataFrameを値とする辞書を返します。
-    ファイルパスがNoneの場合は空の辞書を返します。
+    保存されたExcelファイルについて、シート名を受け取りそのシートだけを読み込む関数を返します。
+    全シートを先に読み込まず、必要なシートだけを都度（キャッシュ付きで）読み込みます。
+    ファイルパスがNoneの場合はNoneを返します。
     """
-    if filepath is not None and os.path.exists(filepath):
-        return pd.read_excel(filepath, sheet_name=None, header=None)
-    return {}
+    if filepath is None or not os.path.exists(filepath):
+        return None
+    mtime = os.path.getmtime(filepath)
+
+    def get_sheet(sheet_name):
+        return load_xlsx(filepath, mtime, sheet_name=sheet_name, header=None)
+
+    return get_sheet
 
 def save_file_and_update_state(uploaded_file, file_key):
     """
@@ -39,9 +59,13 @@ def save_file_and_update_state(uploaded_file, file_key):
     """
     if uploaded_file:
         filepath = os.path.join(SAVE_DIR, uploaded_file.name)
+        info = {"path": filepath, "name": uploaded_file.name, "file_id": uploaded_file.file_id}
+        # 同じアップロードは再実行のたびに書き直さない（mtimeが変わり読込キャッシュが無効になるため）
+        if st.session_state.state.get(file_key) == info:
+            return
         with open(filepath, "wb") as f:
             f.write(uploaded_file.getbuffer())
-        st.session_state.state[file_key] = {"path": filepath, "name": uploaded_file.name}
+        st.session_state.state[file_key] = info
         save_state(st.session_state.state)
 
 # ---------------------------- Streamlit アプリ ----------------------------
@@ -65,14 +89,12 @@ with left_col:
         "data_file": "商品データファイル"
     }
     
+    status_parts = []
     for key, label in status_map.items():
         info = st.session_state.state.get(key)
-        if info and "name" in info:
-            file_status_html += f"<p><strong>{label}</strong>: ✅ {info['name']}</p>"
-        else:
-            file_status_html += f"<p><strong>{label}</strong>: ❌ 未設定</p>"
-    file_status_html += "</div>"
-    st.markdown(file_status_html, unsafe_allow_html=True)
+        status = f"✅ {info['name']}" if info and "name" in info else "❌ 未設定"
+        status_parts.append(f"<p><strong>{label}</strong>: {status}</p>")
+    st.markdown(f"{file_status_html}{''.join(status_parts)}</div>", unsafe_allow_html=True)
 
 with right_col:
     st.header("① ファイルアップロード")
@@ -91,7 +113,7 @@ if st.button("🚀 集計実行"):
     if class_file_path and data_file_path:
         try:
             # --- ② 分類ファイル読み込み ---
-            df_class = pd.read_excel(class_file_path)
+            df_class = load_xlsx(class_file_path, os.path.getmtime(class_file_path))
             df_class['優先フラグ'] = df_class['優先度'].fillna('').apply(lambda x: 1 if str(x).strip() == '〇' else 0)
             df_class['キーワード長'] = df_class['キーワード'].astype(str).apply(
                 lambda x: sum(len(k.strip()) for k in str(x).split('・')) if pd.notna(x) else 0
@@ -100,7 +122,7 @@ if st.button("🚀 集計実行"):
             st.success("✅ 分類わけファイル読み込み完了")
 
             # --- ③ 商品データ読み込み ---
-            df_data = pd.read_excel(data_file_path, header=0)
+            df_data = load_xlsx(data_file_path, os.path.getmtime(data_file_path), header=0)
             st.success("✅ 商品データファイル読み込み完了")
 
             # --- ④ 商品名列検出と分類処理 ---
@@ -112,16 +134,23 @@ if st.button("🚀 集計実行"):
                 st.error("❌ 『商品名』を含む列が見つかりません。")
                 st.stop()
 
-            def classify(name):
-                if pd.isna(name):
-                    return '未分類'
-                for _, row in df_class.iterrows():
-                    keywords = str(row['キーワード']).split('・')
-                    if any(k.strip() in str(name) for k in keywords):
-                        return row['分類']
-                return '未分類'
-
-            df_data['分類'] = df_data['商品名'].apply(classify)
+            # 優先度順のルールを一度だけ展開し、ルールごとに列全体をまとめて判定
+            rules = [
+                (category, [k.strip() for k in str(keyword).split('・')])
+                for category, keyword in zip(df_class['分類'].to_numpy(), df_class['キーワード'].to_numpy())
+            ]
+            names = df_data['商品名'].astype(str)
+            result = np.full(len(df_data), '未分類', dtype=object)
+            unassigned = df_data['商品名'].notna().to_numpy(copy=True)
+            for category, keywords in rules:
+                mask = np.zeros(len(df_data), dtype=bool)
+                for k in keywords:
+                    mask |= names.str.contains(k, regex=False).to_numpy()
+                hit = unassigned & mask
+                result[hit] = category
+                unassigned &= ~hit
+
+            df_data['分類'] = result
 
             # --- 分類済みデータの表示 ---
             st.header("② 分類済みデータのプレビュー")
@@ -134,39 +163,59 @@ if st.button("🚀 集計実行"):
                 st.info("分類後のプレビューデータがありません。")
 
             # --- ⑤ 年・個数・金額ペア抽出 ---
-            records = []
+            pairs = []
             for col in df_data.columns:
                 match = re.match(r'(\d{4})年\d+月_個数', col)
                 if match:
                     year = int(match.group(1))
                     amt_col = col.replace('個数', '金額')
                     if amt_col in df_data.columns:
-                        temp = df_data[['分類', col, amt_col]].copy()
-                        temp.columns = ['分類', '個数', '金額']
-                        temp['個数'] = pd.to_numeric(temp['個数'], errors='coerce').fillna(0)
-                        temp['金額'] = pd.to_numeric(temp['金額'], errors='coerce').fillna(0)
-                        temp['年'] = year
-                        records.append(temp)
-
-            if not records:
+                        pairs.append((year, col, amt_col))
+
+            if not pairs:
                 st.error("❌ 年別の個数・金額列が見つかりませんでした。")
                 st.stop()
 
             # --- ⑥ 集計と前年比 ---
-            df_all = pd.concat(records)
-            df_all = df_all.dropna(subset=['分類']).groupby(['分類', '年']).sum(numeric_only=True).reset_index()
+            # 年ごとのDataFrameを結合してgroupbyせず、分類×年の行列に直接加算する
+            has_class = df_data['分類'].notna().to_numpy()
+            cls_idx, classes = pd.factorize(df_data['分類'][has_class], sort=True)
+            years = sorted({year for year, _, _ in pairs})
+            year_pos = {year: j for j, year in enumerate(years)}
+
+            def column_values(col):
+                return pd.to_numeric(df_data[col], errors='coerce').fillna(0).to_numpy()[has_class]
+
+            qty_values = [(year_pos[year], column_values(qty_col)) for year, qty_col, _ in pairs]
+            amt_values = [(year_pos[year], column_values(amt_col)) for year, _, amt_col in pairs]
+            qty = np.zeros((len(classes), len(years)), dtype=np.result_type(*[v for _, v in qty_values]))
+            amt = np.zeros((len(classes), len(years)), dtype=np.result_type(*[v for _, v in amt_values]))
+            for j, values in qty_values:
+                np.add.at(qty, (cls_idx, j), values)
+            for j, values in amt_values:
+                np.add.at(amt, (cls_idx, j), values)
+
+            df_all = pd.DataFrame({
+                '分類': np.repeat(np.asarray(classes), len(years)),
+                '年': np.tile(years, len(classes)),
+                '個数': qty.ravel(),
+                '金額': amt.ravel(),
+            })
 
             if df_all.empty:
                 st.info("集計するデータがありません。")
                 st.stop()
 
             df_all['前年金額'] = df_all.groupby('分類')['金額'].shift(1)
-            df_all['金額_前年比'] = df_all.apply(
-                lambda row: f"{(row['金額'] / row['前年金額'] * 100):.1f}%"
-                if pd.notnull(row['前年金額']) and row['前年金額'] != 0 else
-                (f"{100.0:.1f}%" if row['金額'] != 0 else "0.0%"),
-                axis=1
+            prev = df_all['前年金額'].to_numpy(dtype=float)
+            cur = df_all['金額'].to_numpy(dtype=float)
+            has_prev = ~np.isnan(prev) & (prev != 0)
+            ratio = np.where(
+                has_prev,
+                cur / np.where(has_prev, prev, 1) * 100,
+                np.where(cur != 0, 100.0, 0.0)
             )
+            df_all['金額_前年比'] = pd.Series(ratio, index=df_all.index).map('{:.1f}%'.format)
             df_all.drop(columns=['前年金額'], inplace=True)
 
             # --- ⑦ ピボット展開 ---
@@ -1,48 +1,190 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import os
 import json
+import logging
+import tempfile
+import openpyxl
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+# python-calamine（Rust製の高速パーサー）が無い環境ではopenpyxlで読み込む
+try:
+    import python_calamine  # noqa: F401
+    EXCEL_ENGINE = "calamine"
+except ImportError:
+    EXCEL_ENGINE = "openpyxl"
+
+logger = logging.getLogger(__name__)
+
+# numbaがあれば前年比の計算をJITコンパイルする（無い環境ではnumpyで計算）
+try:
+    from numba import njit
+except ImportError:
+    njit = None
 
 # ファイル保存用ディレクトリと状態ファイルの設定
 SAVE_DIR = "uploaded_files"
 STATE_FILE = os.path.join(SAVE_DIR, "state.json")
 os.makedirs(SAVE_DIR, exist_ok=True)
 
+# ヘッダ行（得意先コードなど）を探す範囲（先頭からの行数）
+HEADER_SEARCH_ROWS = 200
+
 # ---------------------------- 状態ファイル管理 ----------------------------
+@st.cache_data(show_spinner=False)
+def read_state_file(path, mtime):
+    """状態ファイルを読み込みます。mtimeはキャッシュキーとしてのみ使用し、更新されるまで読み直しません。"""
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
 def load_state():
     """状態ファイルを読み込み、存在しない場合は初期状態を返します。"""
     if os.path.exists(STATE_FILE):
-        with open(STATE_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
+        return read_state_file(STATE_FILE, os.path.getmtime(STATE_FILE))
     return {"prev_file": None, "curr_file": None, "helper_file": None}
 
 def save_state(state):
-    """状態ファイルを保存します。"""
-    with open(STATE_FILE, "w", encoding="utf-8") as f:
-        json.dump(state, f, ensure_ascii=False, indent=2)
+    """状態ファイルを保存します。前回保存した内容から変更がなければ書き込みません。"""
+    serialized = json.dumps(state, ensure_ascii=False, indent=2)
+    persisted = st.session_state.setdefault("_persisted_state", {})
+    if persisted.get(STATE_FILE) == serialized:
+        return
+    # 一時ファイルに書いてから置き換え、書き込み途中の状態ファイルが読まれないようにする
+    # 一時ファイル名は書き込みごとに一意にし、複数セッションが同時に保存しても衝突しないようにする
+    with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=SAVE_DIR, suffix=".tmp", delete=False) as f:
+        f.write(serialized)
+    try:
+        os.replace(f.name, STATE_FILE)
+    except OSError:
+        os.remove(f.name)
+        raise
+    persisted[STATE_FILE] = serialized
 
 # ---------------------------- ヘルパー関数 ----------------------------
 
+def read_xlsx_readonly(source, first_only=False):
+    """
+    openpyxlの読み取り専用モードでシートを読み込み、シート名をキー、DataFrameを値とする辞書を返します。
+    セルのオブジェクトを全て展開しないため、通常モードより高速・省メモリです。
+    first_onlyがTrueの場合は先頭シートだけを読み込みます。
+    """
+    wb = openpyxl.load_workbook(source, read_only=True, data_only=True)
+    try:
+        worksheets = wb.worksheets[:1] if first_only else wb.worksheets
+        return {ws.title: pd.DataFrame(list(ws.iter_rows(values_only=True))) for ws in worksheets}
+    finally:
+        wb.close()
+
+def read_workbook(source, first_only=False):
+    """
+    Excelファイルのシートをヘッダ無しで読み込みます（first_onlyがTrueの場合は先頭シートのみ）。
+    calamineが使えない環境では、openpyxlの読み取り専用モードで読み込みます。
+    """
+    if EXCEL_ENGINE == "calamine":
+        with pd.ExcelFile(source, engine="calamine") as xls:
+            sheet_names = xls.sheet_names[:1] if first_only else xls.sheet_names
+            return {name: xls.parse(name, header=None) for name in sheet_names}
+    return read_xlsx_readonly(source, first_only)
+
 def read_uploaded_file(uploaded_file):
     """
     アップロードされたExcelファイルを読み込み、シート名をキー、DataFrameを値とする辞書を返します。
     ファイルがNoneの場合は空の辞書を返します。
     """
     if uploaded_file is not None:
-        return pd.read_excel(uploaded_file, sheet_name=None, header=None)
+        return read_workbook(uploaded_file)
     return {}
 
+def read_parquet_cache(path, mtime, first_only=False):
+    """
+    Excelファイルより新しいParquetキャッシュがあれば、シート名をキーとする辞書で返します。
+    キャッシュが無い・古い・壊れている場合や、全シートが必要なのに先頭シートしか保存されていない場合はNoneを返します。
+    """
+    manifest_path = os.path.join(path + ".parquet", "sheets.json")
+    if not os.path.exists(manifest_path) or os.path.getmtime(manifest_path) < mtime:
+        return None
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if not first_only and not manifest.get("all_sheets"):
+            return None
+        sheet_names = manifest["sheet_names"][:1] if first_only else manifest["sheet_names"]
+        sheets = {}
+        for i, name in enumerate(sheet_names):
+            df = pd.read_parquet(os.path.join(path + ".parquet", f"{i}.parquet"))
+            # 保存時に文字列にしたobject列は、Excelから読んだ時と同じくobject型・欠損はNaNに戻す
+            str_cols = [col for col in df.columns if pd.api.types.is_string_dtype(df[col])]
+            if str_cols:
+                df[str_cols] = df[str_cols].astype(object).where(df[str_cols].notna(), np.nan)
+            df.columns = range(df.shape[1])  # header=None で読んだ時と同じ列番号に戻す
+            sheets[name] = df
+    except Exception:
+        logger.warning("Parquetキャッシュを読み込めないため、Excelから読み込みます: %s", path, exc_info=True)
+        return None
+    return sheets
+
+def write_parquet_cache(path, sheets, all_sheets):
+    """
+    読み込んだシートをParquet（zstd圧縮）で保存します。保存できなくても処理は続行します。
+    """
+    cache_dir = path + ".parquet"
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        for i, df in enumerate(sheets.values()):
+            # Parquetは列名が文字列で、列内の型が揃っている必要があるため、混在するobject列は文字列にする
+            df = df.astype({col: "string" for col in df.columns if df[col].dtype == object})
+            df.columns = [str(col) for col in df.columns]
+            df.to_parquet(os.path.join(cache_dir, f"{i}.parquet"), engine="pyarrow", compression="zstd")
+        # シート名一覧は最後に書き、すべてのシートが揃ったキャッシュだけを有効にする
+        with open(os.path.join(cache_dir, "sheets.json"), "w", encoding="utf-8") as f:
+            json.dump({"sheet_names": list(sheets), "all_sheets": all_sheets}, f, ensure_ascii=False)
+    except Exception:
+        logger.warning("Parquetキャッシュを保存できませんでした: %s", path, exc_info=True)
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def load_sheets(path, mtime, size, first_only=False):
+    """
+    保存されたExcelファイルのシートを読み込みます（first_onlyがTrueの場合は先頭シートのみ）。
+    一度読み込んだファイルはParquetで保存し、次回以降（再起動後も含む）はそちらを読み込みます。
+    mtimeとsizeはキャッシュキーとしてのみ使用し、ファイルが更新されるまで再読込しません。
+    """
+    sheets = read_parquet_cache(path, mtime, first_only)
+    if sheets is None:
+        sheets = read_workbook(path, first_only)
+        write_parquet_cache(path, sheets, all_sheets=not first_only)
+    return sheets
+
 def save_file_and_update_state(uploaded_file, file_key):
     """
     アップロードされたファイルをローカルに保存し、状態を更新します。
     """
     if uploaded_file:
         filepath = os.path.join(SAVE_DIR, uploaded_file.name)
+        info = {"path": filepath, "name": uploaded_file.name, "file_id": uploaded_file.file_id}
+        # 同じアップロードは再実行のたびに書き直さない（mtimeが変わり読込キャッシュが無効になるため）
+        if st.session_state.state.get(file_key) == info:
+            return
         with open(filepath, "wb") as f:
             f.write(uploaded_file.getbuffer())
-        st.session_state.state[file_key] = {"path": filepath, "name": uploaded_file.name}
+        st.session_state.state[file_key] = info
         save_state(st.session_state.state)
 
+def normalize_codes(codes):
+    """
+    得意先コードを4桁の文字列に揃えます。
+    数値のセルは整数経由で文字列化し（正規表現で".0"を削らない）、
+    文字列のセル（"00123"など）は数値に変換せず、従来どおり末尾の".0"だけを削ります。
+    """
+    is_text = pd.Series(False, index=codes.index) if pd.api.types.is_numeric_dtype(codes) else codes.map(lambda v: isinstance(v, str))
+    num = pd.to_numeric(codes.mask(is_text), errors="coerce")
+    num = num.where(num % 1 == 0)
+    as_str = num.astype("Int64").astype("string[pyarrow]")
+    text = codes.astype(str).str.replace(r"\.0$", "", regex=True).astype("string[pyarrow]")
+    return as_str.fillna(text).str.zfill(4)
+
 def extract_mapping(helper_sheets):
     """
     補助データシートから、除外コード、売上修正マップ、カテゴリマップを抽出します。
@@ -50,32 +192,28 @@ def extract_mapping(helper_sheets):
     exclude_codes = []
     if "削除依頼" in helper_sheets:
         codes = helper_sheets["削除依頼"].iloc[:, 0].dropna()
-        codes = codes.astype(str).str.replace(r"\.0$", "", regex=True).str.zfill(4)
+        codes = normalize_codes(codes)
         exclude_codes = codes.tolist()
 
     fix_sales_map = {}
     if "計算修正" in helper_sheets:
         sheet = helper_sheets["計算修正"].iloc[:, :2].dropna(how="all")
-        for _, row in sheet.iterrows():
-            try:
-                code = str(int(row[0])).zfill(4)
-                factor = float(row[1])
-                fix_sales_map[code] = factor
-            except ValueError:
-                st.warning(f"「計算修正」シートのデータ形式が不正です: {row.tolist()}")
-                continue
+        codes = pd.to_numeric(sheet.iloc[:, 0], errors="coerce")
+        factors = pd.to_numeric(sheet.iloc[:, 1], errors="coerce")
+        valid = codes.notna() & factors.notna()
+        fix_sales_map = dict(zip(codes[valid].astype("int64").map("{:04d}".format), factors[valid].astype(float)))
+        if not valid.all():
+            st.warning(f"「計算修正」シートのデータ形式が不正です: {sheet[~valid].values.tolist()}")
 
     category_map = {}
     if "取引先リスト" in helper_sheets:
         sheet = helper_sheets["取引先リスト"].iloc[:, [0, 2]].dropna(how="all")
-        for _, row in sheet.iterrows():
-            try:
-                code = str(int(row[0])).zfill(4)
-                category = str(row[2]).strip()
-                category_map[code] = category
-            except ValueError:
-                st.warning(f"「取引先リスト」シートのデータ形式が不正です: {row.tolist()}")
-                continue
+        codes = pd.to_numeric(sheet.iloc[:, 0], errors="coerce")
+        valid = codes.notna()
+        categories = sheet.iloc[:, 1].astype(str).str.strip()
+        category_map = dict(zip(codes[valid].astype("int64").map("{:04d}".format), categories[valid]))
+        if not valid.all():
+            st.warning(f"「取引先リスト」シートのデータ形式が不正です: {sheet[~valid].values.tolist()}")
 
     return exclude_codes, fix_sales_map, category_map
 
@@ -83,7 +221,9 @@ def clean_sheet(df, exclude_codes, fix_sales_map, category_map):
     """
     アップロードされた売上データをクリーニングし、必要な列を整形します。
     """
-    header_idx = df[df.apply(lambda r: r.astype(str).str.contains("得意先コード", na=False)).any(axis=1)].index
+    # ヘッダ行は先頭付近にあるため、先頭行だけを文字列配列にして一括で探す
+    head = df.head(HEADER_SEARCH_ROWS).to_numpy(dtype=object).astype(str)
+    header_idx = np.flatnonzero((np.char.find(head, "得意先コード") >= 0).any(axis=1))
     if len(header_idx) == 0:
         return pd.DataFrame()
     header = header_idx[0]
@@ -95,26 +235,70 @@ def clean_sheet(df, exclude_codes, fix_sales_map, category_map):
     if not required_columns.issubset(df.columns):
         return pd.DataFrame()
 
-    df["得意先コード"] = df["得意先コード"].astype(str).str.replace(r"\.0$", "", regex=True).str.zfill(4)
+    df["得意先コード"] = normalize_codes(df["得意先コード"])
     df = df[~df["得意先コード"].isin(exclude_codes)]
 
-    df["純売上額"] = df.apply(
-        lambda r: r["純売上額"] * fix_sales_map.get(r["得意先コード"], 1.0),
-        axis=1
-    )
+    sales = pd.to_numeric(df["純売上額"], errors="coerce").fillna(0).to_numpy(dtype=np.float64)
+    factors = df["得意先コード"].map(fix_sales_map).fillna(1.0).to_numpy(dtype=np.float64)
+    df["純売上額"] = sales * factors
     df["大分類"] = df["得意先コード"].map(category_map).fillna("未分類")
 
-    total_sales = df["純売上額"].sum()
-    df["構成比"] = (df["純売上額"] / total_sales * 100).round(2) if total_sales != 0 else 0.0
+    keys = ["得意先コード", "得意先名", "大分類"]
+    if df["得意先コード"].is_unique:
+        # 得意先ごとに1行しかない場合は集計不要（groupbyと同様にキーが欠損した行は除く）
+        grouped = (
+            df.dropna(subset=keys)[keys + ["純売上額"]]
+            .sort_values("純売上額", ascending=False)
+        )
+    else:
+        grouped = (
+            df.groupby(keys, as_index=False)
+            .agg({"純売上額": "sum"})
+            .sort_values("純売上額", ascending=False)
+        )
+
+    # 構成比は集計後の得意先単位で1回だけ計算する
+    total_sales = grouped["純売上額"].sum()
+    grouped["構成比"] = (grouped["純売上額"].to_numpy() / total_sales * 100).round(2) if total_sales != 0 else 0.0
+
+    # 純売上額（円単位）と構成比はfloat32では丸め誤差が表示に出るため、float64のまま返す
+    # 得意先コード・大分類はカテゴリ型にし、結合や大分類別の集計を整数コードで行う
+    # 得意先名はArrow形式の文字列にし、Pythonオブジェクトを1件ずつ持たないようにする
+    return grouped.astype({
+        "得意先コード": "category", "大分類": "category", "得意先名": "string[pyarrow]",
+    })
 
-    grouped = (
-        df.groupby(["得意先コード", "得意先名", "大分類"], as_index=False)
-        .agg({"純売上額": "sum", "構成比": "sum"})
-        .sort_values("純売上額", ascending=False)
+if njit is not None:
+    @njit(cache=True)
+    def yoy_ratio_kernel(prev, curr, out):
+        """前年比(%)を1回のループで計算し、outに書き込みます（中間配列を作らない）。"""
+        for i in range(prev.size):
+            p = prev[i]
+            c = curr[i]
+            if p != 0:
+                out[i] = round(c / p * 100, 1)
+            elif c != 0:
+                out[i] = 100.0
+            else:
+                out[i] = 0.0
+
+def yoy_ratio(prev, curr):
+    """
+    前年比(%)を計算します。前年が0の場合は、今年に売上があれば100.0、なければ0.0とします。
+    numbaがある環境ではJITコンパイルしたループで計算します。
+    """
+    prev = prev.to_numpy(dtype=np.float64)
+    curr = curr.to_numpy(dtype=np.float64)
+    if njit is not None:
+        out = np.empty(prev.size, dtype=np.float64)
+        yoy_ratio_kernel(prev, curr, out)
+        return out
+    return np.where(
+        prev != 0,
+        np.round(curr / np.where(prev == 0, 1, prev) * 100, 1),
+        np.where(curr != 0, 100.0, 0.0)
     )
 
-    return grouped
-
 def compare_years(prev_df, curr_df):
     """
     前年データと今年データを比較し、差額と前年比を計算します。
@@ -130,15 +314,15 @@ def compare_years(prev_df, curr_df):
     for col in ["純売上額_前年", "純売上額_今年", "構成比_前年", "構成比_今年"]:
         merged[col] = merged[col].fillna(0)
 
-    merged["純売上額_前年"] = (merged["純売上額_前年"] / 1000).round().astype("Int64")
-    merged["純売上額_今年"] = (merged["純売上額_今年"] / 1000).round().astype("Int64")
+    # カテゴリが前年・今年で異なると結合後はobject型に戻るため、カテゴリ型に戻す
+    merged["得意先コード"] = merged["得意先コード"].astype("category")
+    merged["大分類"] = merged["大分類"].astype("category")
+
+    merged["純売上額_前年"] = (merged["純売上額_前年"] / 1000).round().astype("Int32")
+    merged["純売上額_今年"] = (merged["純売上額_今年"] / 1000).round().astype("Int32")
 
     merged["差額"] = merged["純売上額_今年"] - merged["純売上額_前年"]
-    merged["前年比(%)"] = merged.apply(
-        lambda row: round(row["純売上額_今年"] / row["純売上額_前年"] * 100, 1)
-        if row["純売上額_前年"] != 0 else (100.0 if row["純売上額_今年"] != 0 else 0.0),
-        axis=1
-    )
+    merged["前年比(%)"] = yoy_ratio(merged["純売上額_前年"], merged["純売上額_今年"])
 
     ordered_cols = [
         "得意先コード", "得意先名", "大分類",
@@ -152,18 +336,24 @@ def summarize_by_category(comp_df):
     """
     カテゴリ別に売上データを集計します。
     """
-    cat = comp_df.groupby("大分類", as_index=False).agg({
+    cat = comp_df.groupby("大分類", as_index=False, observed=True).agg({
         "純売上額_前年": "sum",
         "純売上額_今年": "sum",
         "差額": "sum"
     })
-    cat["前年比(%)"] = cat.apply(
-        lambda r: round(r["純売上額_今年"] / r["純売上額_前年"] * 100, 1)
-        if r["純売上額_前年"] != 0 else (100.0 if r["純売上額_今年"] != 0 else 0.0),
-        axis=1
-    )
+    cat["前年比(%)"] = yoy_ratio(cat["純売上額_前年"], cat["純売上額_今年"])
     return cat
 
+def sort_variants(df):
+    """
+    Step 3 の並び替え（今年売上順・差額ベスト順・差額ワースト順）をまとめて作成します。
+    """
+    return {
+        "today": df.sort_values("純売上額_今年", ascending=False),
+        "best": df.sort_values("差額", ascending=False),
+        "worst": df.sort_values("差額", ascending=True),
+    }
+
 # ---------------------------- Streamlit アプリ ----------------------------
 
 st.set_page_config(page_title="卸営業数値分析システム", layout="wide")
@@ -186,14 +376,12 @@ with left_col:
         "helper_file": "補助データ"
     }
     
+    status_parts = []
     for key, label in status_map.items():
         info = st.session_state.state.get(key)
-        if info and "name" in info:
-            file_status_html += f"<p><strong>{label}</strong>: ✅ {info['name']}</p>"
-        else:
-            file_status_html += f"<p><strong>{label}</strong>: ❌ 未設定</p>"
-    file_status_html += "</div>"
-    st.markdown(file_status_html, unsafe_allow_html=True)
+        status = f"✅ {info['name']}" if info and "name" in info else "❌ 未設定"
+        status_parts.append(f"<p><strong>{label}</strong>: {status}</p>")
+    st.markdown(f"{file_status_html}{''.join(status_parts)}</div>", unsafe_allow_html=True)
     
 with right_col:
     st.header("📁 ファイルアップロード")
@@ -215,9 +403,15 @@ if st.button("🚀 分析実行"):
     
     if prev_file_path and curr_file_path and helper_file_path:
         try:
-            prev_sheets = pd.read_excel(prev_file_path, sheet_name=None, header=None)
-            curr_sheets = pd.read_excel(curr_file_path, sheet_name=None, header=None)
-            helper_sheets = pd.read_excel(helper_file_path, sheet_name=None, header=None)
+            # 3ファイルを並列に読み込む（ワーカースレッドにもスクリプトのコンテキストを引き継ぐ）
+            ctx = get_script_run_ctx()
+            with ThreadPoolExecutor(max_workers=3, initializer=lambda: add_script_run_ctx(threading.current_thread(), ctx)) as executor:
+                # 前年・今年データは先頭シートしか使わないため、先頭シートだけを読み込む
+                prev_f, curr_f, helper_f = [
+                    executor.submit(load_sheets, path, os.path.getmtime(path), os.path.getsize(path), first_only)
+                    for path, first_only in ((prev_file_path, True), (curr_file_path, True), (helper_file_path, False))
+                ]
+                prev_sheets, curr_sheets, helper_sheets = prev_f.result(), curr_f.result(), helper_f.result()
             
             exclude_codes, fix_sales_map, category_map = extract_mapping(helper_sheets)
 
@@ -225,12 +419,12 @@ if st.button("🚀 分析実行"):
             if not prev_sheets:
                 st.error("前年データファイルにシートが見つかりません。")
                 st.stop()
-            prev_sheet_df = list(prev_sheets.values())[0]
+            prev_sheet_df = next(iter(prev_sheets.values()))
 
             if not curr_sheets:
                 st.error("今年データファイルにシートが見つかりません。")
                 st.stop()
-            curr_sheet_df = list(curr_sheets.values())[0]
+            curr_sheet_df = next(iter(curr_sheets.values()))
 
             prev_clean = clean_sheet(prev_sheet_df, exclude_codes, fix_sales_map, category_map)
             curr_clean = clean_sheet(curr_sheet_df, exclude_codes, fix_sales_map, category_map)
@@ -244,6 +438,9 @@ if st.button("🚀 分析実行"):
             st.session_state.curr_clean = curr_clean
             st.session_state.comp_df = compare_years(prev_clean, curr_clean)
             st.session_state.summary_df = summarize_by_category(st.session_state.comp_df)
+            # Step 3 の並び替えは分析時に一度だけ行い、選択肢の切り替えでは並び替えない
+            st.session_state.comp_sorted = sort_variants(st.session_state.comp_df)
+            st.session_state.summary_sorted = sort_variants(st.session_state.summary_df)
             st.success("分析完了！")
             st.rerun() # 計算が完了したら、ページを再実行して結果を表示
 
@@ -254,7 +451,7 @@ if st.button("🚀 分析実行"):
 
 
 # --- 修正: セッションステートにデータがある場合にのみ結果を表示 ---
-if "comp_df" in st.session_state and "summary_df" in st.session_state:
+if all(key in st.session_state for key in ["comp_df", "summary_df", "comp_sorted", "summary_sorted"]):
     
     st.markdown("---") # 視覚的な区切り線
     
@@ -291,15 +488,16 @@ if "comp_df" in st.session_state and "summary_df" in st.session_state:
         key="sort_option_select"
     )
 
+    if "_純売上額_" in option:
+        sort_key = "today"
+    elif "ベスト" in option:
+        sort_key = "best"
+    else: # ワースト
+        sort_key = "worst"
+
     # 選択されたオプションに基づいて処理を分岐
     if option.startswith("大分類別"):
-        summary_df = st.session_state.summary_df.copy() # オリジナルを保持するためコピー
-        if "_純売上額_" in option:
-            summary_sorted = summary_df.sort_values("純売上額_今年", ascending=False)
-        elif "ベスト" in option:
-            summary_sorted = summary_df.sort_values("差額", ascending=False)
-        else: # ワースト
-            summary_sorted = summary_df.sort_values("差額", ascending=True)
+        summary_sorted = st.session_state.summary_sorted[sort_key]
         
         st.subheader("大分類別：集計結果")
         if not summary_sorted.empty:
@@ -308,13 +506,7 @@ if "comp_df" in st.session_state and "summary_df" in st.session_state:
         else:
             st.info("集計するデータがありません。")
     else: # 得意先別
-        comp_df = st.session_state.comp_df.copy() # オリジナルを保持するためコピー
-        if "_純売上額_" in option:
-            df_sorted = comp_df.sort_values("純売上額_今年", ascending=False)
-        elif "ベスト" in option:
-            df_sorted = comp_df.sort_values("差額", ascending=False)
-        else: # ワースト
-            df_sorted = comp_df.sort_values("差額", ascending=True)
+        df_sorted = st.session_state.comp_sorted[sort_key]
         
         st.subheader("得意先別：比較結果")
         if not df_sorted.empty: